@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, flash, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, flash, redirect, url_for
 import pandas as pd
 from openai import OpenAI
 import os
@@ -6,9 +6,19 @@ from dotenv import load_dotenv
 load_dotenv()
 import secrets
 import re       # Regular expressions for markdown conversion (String -> html)
+import json
+import io
 from plotly.graph_objects import Figure
 from flask_cors import CORS
-from graph import generate_graph, get_graph_recommendation
+from graph import generate_graph_spec, get_graph_recommendation
+from figure_pool import render_graph_html
+from questions import MAX_BATCH_QUESTIONS, answer_batch, answer_question, build_context
+from dataset import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, dataset_hash, page_frame, parse_filter,
+                     select_rows, to_arrow_ipc, to_compact_json)
+from timeseries import index_time_columns, prepare_line
+from token_budget import Section, TokenQuotaExceeded, complete, current_session, token_metrics
+from http_cache import (IMMUTABLE_CACHE_CONTROL, NO_STORE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, cached_figure,
+                        compress_response, etag_for, matches_etag, not_modified, remember_figure)
 
 secret = secrets.token_urlsafe(32)
 
@@ -26,56 +36,167 @@ client = OpenAI(api_key=api_key)
 
 # Global variables:
 # data_df: Holds the pandas DataFrame from an uploaded CSV file.
+# data_hash: Holds the content hash identifying the uploaded CSV file.
 # description: Holds the textual description of the DataFrame (generated using describe()).
-# graph: Holds the generated graph visualization figure.
+# graph: Holds the HTML of the most recently generated graph visualization.
 # summary_content: Holds the summary text generated from the dataset using OpenAI.
+# table_cache: Holds the HTML description table generated for each dataset hash.
+# chart_cache: Holds the (graph_type, spec) chosen by the model for each dataset hash.
 data_df = None
+data_hash = None
 description = None
 graph = None
 summary_content = None
+table_cache = {}
+chart_cache = {}
+
+# -------------------------------------------------------------
+# Compresses every outgoing response the client accepts compressed (see http_cache).
+# -------------------------------------------------------------
+@app.after_request
+def compress(response):
+    return compress_response(response)
+
+# -------------------------------------------------------------
+# Turns an exhausted session token quota (see token_budget) into a 429 response.
+# -------------------------------------------------------------
+@app.errorhandler(TokenQuotaExceeded)
+def token_quota_exceeded(error):
+    return jsonify({"error": str(error)}), 429
+
+# -------------------------------------------------------------
+# Endpoint to inspect token usage.
+#
+# Returns:
+#      JSON: The estimator and calibration in use, per call site counters, prompt budgets
+#      and current max_tokens, aggregate usage over all sessions, and the caller's own usage
+#      against the quota. Other sessions are never listed individually.
+# -------------------------------------------------------------
+@app.route("/metrics/tokens")
+def tokens_metrics():
+    return jsonify(token_metrics(current_session()))
 
 # -------------------------------------------------------------
 # Endpoint to generate HTML table data and graph visualization from dataset description.
 #
-# Uses OpenAI ChatCompletion to generate a markdown table from the dataset description,
-# converts the markdown to HTML, generates a graph using generate_graph, and returns both as HTML.
+# Uses OpenAI ChatCompletion to generate a markdown table from the dataset description
+# (once per dataset), converts the markdown to HTML, picks the graph columns and title with
+# generate_graph_spec, renders the figure in the figure process pool, and returns both as HTML.
+#
+# The chosen chart is kept per dataset until the next upload, or until the request
+# passes new_chart=1. The response carries a strong ETag derived from the dataset hash,
+# the chart and the table, so repeated requests return 304 Not Modified (or the rendered
+# payload) without any OpenAI call. The payload can be fetched again from /figures/<figure_id>.
+# A reduced-resolution fallback figure is sent with no-store and without ETag or figure_id,
+# so the next request renders the full chart again.
+#
+# Query parameters:
+#     new_chart (str): '1' to ask the model for a new chart.
 #
 # Returns:
-#     An HTML page containing the graph HTML (for debugging) and the table.
+#     JSON: Contains 'graph_html', 'table' and 'figure_id' (None for a fallback figure).
 # -------------------------------------------------------------
 @app.route("/details")
 def details():
     print("HELLO JAMES THIS IS DETAILS")
-    prompt = f"""output the relevant data in html table format: {description}.
-    Start with the table itself, with nothing else.
-    Also, round the numbers two decimal places.
-    Try your best to make the headers less than three words without losing its meaning."""
-    # Generate table with OpenAI
-    tableResponse = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=1000
-    )
-    table = markdown_table_to_html(tableResponse.choices[0].message.content)
     global graph
+    table = table_cache.get(data_hash)
+    chart = None if request.args.get("new_chart") == "1" else chart_cache.get(data_hash)
+    if table is not None and chart is not None:
+        etag = etag_for(data_hash, *chart, table)
+        if matches_etag(etag):
+            return not_modified(etag)
+        payload = cached_figure(etag)
+        if payload is not None:
+            graph = payload["graph_html"]
+            return details_response(payload, etag)
+    if table is None:
+        prompt = [
+            "output the relevant data in html table format: ",
+            Section(description),
+            """.
+        Start with the table itself, with nothing else.
+        Also, round the numbers two decimal places.
+        Try your best to make the headers less than three words without losing its meaning."""
+        ]
+        # Generate table with OpenAI
+        tableResponse = complete(client, "details_table", prompt)
+        table = markdown_table_to_html(tableResponse.choices[0].message.content)
+        table_cache[data_hash] = table
     print(description)
     print("TABLE")
     print(table)
-    graph_type = get_graph_recommendation(data_df)
-    fig = generate_graph(data_df, graph_type)
-    if fig is None:
-        print("Graph generation failed.")
-        return jsonify({"error": "Failed to generate graph."})
-    print("FIG")
-    print(fig)
-    graph = fig
-    graph_html = fig.to_html(full_html=False, include_plotlyjs="cdn")
-    if graph_html:
-        print("yes there is a graph")
-    html_output = f"<html><body><h1>Graph Debug Output</h1>{graph_html}<hr><h2>Table</h2>{table}</body></html>"
-    with open("graph_debug.html", "w", encoding="utf-8") as f:
-        f.write(html_output)
-    return jsonify({"graph_html": graph_html, "table": table})
+    if chart is None:
+        graph_type = get_graph_recommendation(data_df)
+        spec = generate_graph_spec(data_df, graph_type)
+        if spec is None:
+            print("Graph generation failed.")
+            return jsonify({"error": "Failed to generate graph."})
+        chart = chart_cache[data_hash] = (graph_type, spec)
+    graph_type, spec = chart
+    print("SPEC")
+    print(spec)
+    etag = etag_for(data_hash, graph_type, spec, table)
+    if matches_etag(etag):
+        return not_modified(etag)
+    payload = cached_figure(etag)
+    if payload is None:
+        # Line charts over date/sequence columns are resampled before plotting
+        frame, *render_spec = prepare_line(data_df, data_hash, *spec) if graph_type == "Line" else (data_df, *spec)
+        # Figure construction and serialization run in a worker process to keep this thread responsive
+        graph_html, degraded = render_graph_html(frame, graph_type, *render_spec)
+        if graph_html:
+            print("yes there is a graph")
+        html_output = f"<html><body><h1>Graph Debug Output</h1>{graph_html}<hr><h2>Table</h2>{table}</body></html>"
+        with open("graph_debug.html", "w", encoding="utf-8") as f:
+            f.write(html_output)
+        if degraded:
+            graph = graph_html
+            return details_response({"graph_html": graph_html, "table": table, "figure_id": None}, None)
+        payload = {"graph_html": graph_html, "table": table, "figure_id": etag}
+        remember_figure(etag, payload)
+    graph = payload["graph_html"]
+    return details_response(payload, etag)
+
+# -------------------------------------------------------------
+# Helper to build a /details response with its ETag and Cache-Control headers.
+#
+# Parameters:
+#      payload (dict): The figure payload.
+#      etag (str): The payload's ETag, or None for a degraded payload that must not be reused.
+#
+# Returns:
+#      Response: The JSON response.
+# -------------------------------------------------------------
+def details_response(payload, etag):
+    response = jsonify(payload)
+    if etag is None:
+        response.headers["Cache-Control"] = NO_STORE_CACHE_CONTROL
+        return response
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return response
+
+# -------------------------------------------------------------
+# Endpoint to fetch a figure payload previously returned by /details.
+#
+# The figure_id is the payload's ETag, so the content behind a URL never changes
+# and is served with immutable Cache-Control.
+#
+# Returns:
+#     JSON: Contains 'graph_html', 'table' and 'figure_id', or 404 if it is no longer cached.
+# -------------------------------------------------------------
+@app.route("/figures/<figure_id>")
+def figure(figure_id):
+    if matches_etag(figure_id):
+        return not_modified(figure_id, IMMUTABLE_CACHE_CONTROL)
+    payload = cached_figure(figure_id)
+    if payload is None:
+        return jsonify({"error": "Unknown figure"}), 404
+    response = jsonify(payload)
+    response.set_etag(figure_id)
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
 
 # -------------------------------------------------------------
 # Endpoint to upload a CSV file, read it into a pandas DataFrame, and generate a summary.
@@ -88,56 +209,152 @@ def details():
 # -------------------------------------------------------------
 @app.route("/upload", methods=["POST"])
 def upload_file():
-    global data_df, summary_content
+    global data_df, data_hash, summary_content
     global description
     file = request.files["datafile"]
     if not file:
         return jsonify({"error": "No file provided"}), 400
-    data_df = pd.read_csv(file)
+    raw = file.read()
+    data_hash = dataset_hash(raw)
+    table_cache.clear()
+    chart_cache.clear()
+    data_df = pd.read_csv(io.BytesIO(raw))
+    # Detect and sort date/sequence columns once so Line charts can be resampled cheaply
+    index_time_columns(data_df, data_hash)
     description = data_df.describe().to_string()
-    prompt = f"create a summary of the data (with bullet points): {data_df}"
+    prompt = ["create a summary of the data (with bullet points): ", Section(str(data_df))]
     # Generate summary with OpenAI
-    summary = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=1000
-    )
+    summary = complete(client, "upload_summary", prompt)
     summary_content = summary.choices[0].message.content
     flash(summary_content)  # Use flash to pass data to another route
     return jsonify({"summary": summary_content})
 
 # -------------------------------------------------------------
-# Endpoint to answer a question based on uploaded CSV data.
+# Endpoint to answer one or many questions based on uploaded CSV data.
 #
 # Retrieves the question from JSON payload, generates a response using OpenAI
 # based on the dataset description and summary, converts markdown answer to HTML,
 # and returns it.
 #
+# A batch is sent as {"questions": [...], "pack": false}. Questions are normalized and
+# deduplicated, answered concurrently against one shared context (optionally packing
+# short questions into one completion), and streamed back as newline-delimited JSON
+# in completion order.
+#
 # Returns:
 #      JSON: Contains the 'answer'.
+#      NDJSON (batch): One {'index', 'question', 'answer' | 'error'} object per question.
 # -------------------------------------------------------------
 @app.route("/ask", methods=["POST"])
 def ask_question():
     global summary_content
-    question = request.json.get("question", "")
+    payload = request.json or {}
+    if "questions" in payload:
+        return ask_questions(payload)
+    question = payload.get("question", "")
     print(question)
     if not question:
         return jsonify({"error": "No question provided"}), 400
     if data_df is None:
         return jsonify({"error": "No data loaded"}), 400
-    description = data_df.describe().to_string()
-    prompt = f"Question: {question}\n\nSummary:\n{summary_content}\n\nData Summary:\n{description}\n\nAnswer:"
     # Generate response based on question and summary
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "Try to answer the question in one sentence (300 tokens)."},
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=300
-    )
-    print("answer: ", response.choices[0].message.content)
-    return jsonify({"answer": markdown_to_html(response.choices[0].message.content)})
+    answer = answer_question(client, question, build_context(summary_content, description), current_session())
+    print("answer: ", answer)
+    return jsonify({"answer": markdown_to_html(answer)})
+
+# -------------------------------------------------------------
+# Helper for the batch form of /ask.
+#
+# Parameters:
+#      payload (dict): The JSON body with 'questions' and optional 'pack'.
+#
+# Returns:
+#      Response: A streamed NDJSON response, or a JSON error.
+# -------------------------------------------------------------
+def ask_questions(payload):
+    questions = payload.get("questions")
+    if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+        return jsonify({"error": "'questions' must be a list of strings"}), 400
+    if not any(question.strip() for question in questions):
+        return jsonify({"error": "No question provided"}), 400
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return jsonify({"error": f"At most {MAX_BATCH_QUESTIONS} questions can be asked at once"}), 400
+    if data_df is None:
+        return jsonify({"error": "No data loaded"}), 400
+    context = build_context(summary_content, description)
+    pack = bool(payload.get("pack", False))
+    # The stream outlives the request context, so the session is resolved up front
+    session = current_session()
+
+    def generate():
+        results = answer_batch(client, questions, context, pack=pack, session=session)
+        try:
+            for result in results:
+                if "answer" in result:
+                    result["answer"] = markdown_to_html(result["answer"])
+                yield json.dumps(result) + "\n"
+        finally:
+            # Closing the batch on client disconnect cancels its queued completions
+            results.close()
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+# -------------------------------------------------------------
+# Endpoint to page through the uploaded CSV data.
+#
+# Query parameters:
+#      offset (int): First row of the page (default 0).
+#      limit (int): Number of rows (default DEFAULT_PAGE_SIZE, at most MAX_PAGE_SIZE).
+#      columns (str): Comma separated list of columns to return (default all).
+#      sort (str): Column to sort by; date columns sort chronologically. Sort orders are cached per dataset.
+#      order (str): 'asc' (default) or 'desc'.
+#      filter (str): column:operator:value, repeatable; operators are eq, ne, lt, le, gt, ge, contains.
+#      format (str): 'json' (default) or 'arrow'.
+#
+# Responses carry an ETag derived from the dataset hash and the query, and a matching
+# If-None-Match request returns 304 Not Modified.
+#
+# Returns:
+#      JSON: {'total', 'offset', 'columns', 'rows'}, or an Arrow IPC stream with the page.
+# -------------------------------------------------------------
+@app.route("/data")
+def data_page():
+    if data_df is None:
+        return jsonify({"error": "No data loaded"}), 400
+    output_format = request.args.get("format", "json")
+    if output_format not in ("json", "arrow"):
+        return jsonify({"error": "format must be 'json' or 'arrow'"}), 400
+    query = sorted(request.args.items(multi=True))
+    etag = etag_for(data_hash, query)
+    if matches_etag(etag):
+        return not_modified(etag)
+    try:
+        offset = max(int(request.args.get("offset", 0)), 0)
+        limit = min(max(int(request.args.get("limit", DEFAULT_PAGE_SIZE)), 0), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "offset and limit must be integers"}), 400
+    columns = [column for column in request.args.get("columns", "").split(",") if column]
+    sort = request.args.get("sort")
+    for column in columns + ([sort] if sort else []):
+        if column not in data_df.columns:
+            return jsonify({"error": f"Unknown column '{column}'"}), 400
+    # Date columns are filtered and sorted on their parsed timestamps rather than their text
+    time_columns = index_time_columns(data_df, data_hash)
+    try:
+        filters = [parse_filter(data_df, expression, time_columns) for expression in request.args.getlist("filter")]
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    positions = select_rows(data_df, data_hash, sort, request.args.get("order", "asc") != "desc", filters,
+                            time_columns)
+    frame = page_frame(data_df, positions, offset, limit, columns)
+    if output_format == "arrow":
+        response = Response(to_arrow_ipc(frame), mimetype="application/vnd.apache.arrow.stream")
+        response.headers["X-Total-Count"] = str(len(positions))
+    else:
+        response = Response(to_compact_json(frame, len(positions), offset), mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = REVALIDATE_CACHE_CONTROL
+    return response
 
 # -------------------------------------------------------------
 # Endpoint to process a message by prepending it with 'hi '.
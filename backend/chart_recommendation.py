@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from openai import OpenAI
+from token_budget import Section, complete
 
 # Load environment variables
 load_dotenv()
@@ -68,16 +69,13 @@ chart_requirements = {
     """
 def get_graph_recommendation(data):
     print(data)
-    prompt = (
-        f"Recommend a graph for this data to best represent the data: {data}. "
-        f"Here are your responce options: {CHART_OPTIONS} but you cannot use these options: {invalid_chart_types}. "
+    prompt = [
+        "Recommend a graph for this data to best represent the data: ",
+        Section(str(data)),
+        f". Here are your responce options: {CHART_OPTIONS} but you cannot use these options: {invalid_chart_types}. "
         "only use one word from the list as your response"
-    )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    )
+    ]
+    response = complete(client, "graph_recommendation", prompt)
     rec = response.choices[0].message.content
     print(rec)
     print("wow")
@@ -158,15 +156,12 @@ def validate_graph_type(data, graph_type):
     print(requirements)
     if requirements == "Invalid Chart Type":
         return False
-    prompt = (
-        f"Does the data meet these requirements for a {graph_type}: {requirements}? "
-        f"Here is the data {data}. Provide a yes or no answer without extra characters, do not put a period."
-    )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    )
+    prompt = [
+        f"Does the data meet these requirements for a {graph_type}: {requirements}? Here is the data ",
+        Section(str(data)),
+        ". Provide a yes or no answer without extra characters, do not put a period."
+    ]
+    response = complete(client, "graph_validation", prompt)
     answer = response.choices[0].message.content.strip().lower()
     print("is it valid? " + answer)
     return answer == "yes"
@@ -187,16 +182,15 @@ def find_best_columns(data, graph_type):
     req = get_chart_requirements(graph_type.lower())
     if req == "Invalid Chart Type":
         return None, None
-    prompt = (
-        f"Given the data {data} and the graph type {graph_type}, which columns out of these {data.columns} "
-        f"should be used based on these requirements: {req}? Do not choose columns that match in the following list: {chart_memory}. "
-        "Provide only the column names in a comma-separated format."
-    )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    )
+    prompt = [
+        "Given the data ",
+        Section(str(data), priority=1),
+        f" and the graph type {graph_type}, which columns out of these {data.columns} "
+        f"should be used based on these requirements: {req}? Do not choose columns that match in the following list: ",
+        Section(str(chart_memory), priority=0, keep="tail"),
+        ". Provide only the column names in a comma-separated format."
+    ]
+    response = complete(client, "graph_columns", prompt)
     rec = response.choices[0].message.content.strip()
     if rec.lower() == "none":
         return None, None
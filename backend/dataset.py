@@ -0,0 +1,217 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+"""
+This module serves pages of the uploaded dataset.
+It identifies datasets by a content hash, caches sort orders and filter masks per dataset,
+and encodes pages either as compact JSON or as an Arrow IPC stream.
+"""
+
+# Number of rows returned when no limit is requested, and the largest limit accepted.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+
+# Maximum number of sort orders and filter masks kept in the index cache.
+INDEX_CACHE_SIZE = 32
+
+# Comparison operators accepted in filters, in the form column:operator:value.
+FILTER_OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "ne": lambda column, value: column != value,
+    "lt": lambda column, value: column < value,
+    "le": lambda column, value: column <= value,
+    "gt": lambda column, value: column > value,
+    "ge": lambda column, value: column >= value,
+    "contains": lambda column, value: column.astype(str).str.contains(str(value), case=False, regex=False),
+}
+
+# Least recently used cache of sort orders and filter masks, keyed by dataset hash.
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def dataset_hash(raw_bytes):
+    """
+    Computes the identifier of an uploaded dataset from its raw file contents.
+
+    Parameters:
+        raw_bytes: The uploaded file contents.
+
+    Returns:
+        A hex digest that changes whenever the file contents change.
+    """
+    return hashlib.blake2b(raw_bytes, digest_size=16).hexdigest()
+
+
+def _cached(key, compute):
+    """
+    Returns the cached index for key, computing and storing it on a miss.
+
+    The cache is shared by request threads; the computation itself runs outside the lock.
+    """
+    with _index_cache_lock:
+        if key in _index_cache:
+            _index_cache.move_to_end(key)
+            return _index_cache[key]
+    value = compute()
+    with _index_cache_lock:
+        _index_cache[key] = value
+        if len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return value
+
+
+def parse_filter(data, expression, time_columns=None):
+    """
+    Parses a filter expression of the form column:operator:value.
+
+    Parameters:
+        data: The DataFrame being filtered.
+        expression: The filter expression. The column name may itself contain colons.
+        time_columns: The temporal columns from timeseries.index_time_columns, if any.
+
+    Returns:
+        A (column, operator, value) tuple, with value converted to a number for numeric columns.
+        On date columns (kind 'time') the value is converted to a timestamp, except for eq/ne
+        filters naming an exact label of the column (e.g. 'Summer 2014'), which compare the text.
+
+    Raises:
+        ValueError: If the expression, column, operator or value is invalid.
+    """
+    parts = expression.rsplit(":", 2)
+    if len(parts) != 3:
+        raise ValueError(f"Invalid filter '{expression}', expected column:operator:value")
+    column, operator, value = parts
+    if column not in data.columns:
+        raise ValueError(f"Unknown column '{column}'")
+    if operator not in FILTER_OPERATORS:
+        raise ValueError(f"Unknown filter operator '{operator}'")
+    is_date = (time_columns or {}).get(column, (None, None, None))[2] == "time"
+    is_label = is_date and operator in ("eq", "ne") and (data[column].astype(str) == value).any()
+    if operator != "contains" and is_date and not is_label:
+        try:
+            value = pd.Timestamp(value)
+        except ValueError:
+            raise ValueError(f"Filter value '{value}' is not a date for column '{column}'")
+    elif operator != "contains" and pd.api.types.is_numeric_dtype(data[column]):
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError(f"Filter value '{value}' is not numeric for column '{column}'")
+    return column, operator, value
+
+
+def filter_mask(data, data_hash, filters, time_columns=None):
+    """
+    Computes the boolean row mask for a list of parsed filters, combined with AND.
+
+    Filters with a timestamp value compare against the parsed timestamps in time_columns.
+    """
+    def compute():
+        mask = np.ones(len(data), dtype=bool)
+        for column, operator, value in filters:
+            values = pd.Series(time_columns[column][0]) if isinstance(value, pd.Timestamp) else data[column]
+            mask &= FILTER_OPERATORS[operator](values, value).fillna(False).to_numpy(dtype=bool)
+        return mask
+    return _cached((data_hash, "filter", tuple(filters)), compute)
+
+
+def sort_order(data, data_hash, column, ascending=True, time_columns=None):
+    """
+    Computes the row positions of data sorted by column, with missing values last.
+
+    Temporal columns in time_columns are sorted by their parsed values, reusing the cached order,
+    so that text such as MM/DD/YYYY dates sorts chronologically.
+    """
+    def compute():
+        if column in (time_columns or {}):
+            parsed, order, _ = time_columns[column]
+            if ascending:
+                return order
+            missing = pd.isna(parsed)
+            present = np.flatnonzero(~missing)
+            keys = parsed[present].astype("int64") if parsed.dtype.kind == "M" else parsed[present]
+            # A stable sort on negated keys keeps file order among ties, as for other columns
+            return np.concatenate([present[np.argsort(-keys, kind="stable")], np.flatnonzero(missing)])
+        values = data[column].reset_index(drop=True)
+        try:
+            ordered = values.sort_values(ascending=ascending, kind="stable", na_position="last")
+        except TypeError:
+            # Object columns with mixed types cannot be compared directly
+            ordered = values.astype(str).where(values.notna()).sort_values(
+                ascending=ascending, kind="stable", na_position="last"
+            )
+        return ordered.index.to_numpy()
+    return _cached((data_hash, "sort", column, ascending, column in (time_columns or {})), compute)
+
+
+def select_rows(data, data_hash, sort=None, ascending=True, filters=(), time_columns=None):
+    """
+    Computes the row positions matching the filters, in the requested order.
+
+    Parameters:
+        data: The DataFrame.
+        data_hash: The dataset identifier used as cache key.
+        sort: Column to sort by, or None to keep file order.
+        ascending: Sort direction.
+        filters: Parsed filters from parse_filter.
+        time_columns: The temporal columns passed to parse_filter, also used for sorting.
+
+    Returns:
+        A numpy array of row positions.
+    """
+    positions = sort_order(data, data_hash, sort, ascending, time_columns) if sort else np.arange(len(data))
+    if filters:
+        positions = positions[filter_mask(data, data_hash, filters, time_columns)[positions]]
+    return positions
+
+
+def page_frame(data, positions, offset, limit, columns=None):
+    """
+    Slices one page of rows and projects the requested columns.
+    """
+    frame = data.iloc[positions[offset:offset + limit]]
+    if columns:
+        frame = frame[columns]
+    return frame
+
+
+def to_compact_json(frame, total, offset):
+    """
+    Encodes a page as compact JSON: column names once, then rows as arrays of values.
+
+    Parameters:
+        frame: The page of rows.
+        total: Number of rows matching the query before paging.
+        offset: Position of the first row in the page.
+
+    Returns:
+        The JSON document as a string.
+    """
+    rows = frame.to_json(orient="values", date_format="iso")
+    header = json.dumps({"total": int(total), "offset": offset, "columns": [str(column) for column in frame.columns]})
+    return header[:-1] + f', "rows": {rows}}}'
+
+
+def to_arrow_ipc(frame):
+    """
+    Encodes a page as an Arrow IPC stream.
+
+    Object columns that Arrow cannot represent (e.g. mixed types) are sent as strings.
+    """
+    frame = frame.reset_index(drop=True)
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        mixed = {column: "string" for column in frame.columns if frame[column].dtype == object}
+        table = pa.Table.from_pandas(frame.astype(mixed), preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
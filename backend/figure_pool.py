@@ -0,0 +1,223 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pyarrow as pa
+
+from graph import build_figure
+
+"""
+This module renders Plotly figures in a pool of worker processes.
+Figure construction and to_html hold the GIL for seconds on large frames, so they are moved
+out of the Flask process. Workers only receive the columns a chart needs, encoded as Arrow IPC.
+"""
+
+# Number of worker processes used to build figures.
+FIGURE_WORKERS = int(os.getenv("FIGURE_WORKERS", "2"))
+
+# Seconds a request waits for a worker before falling back to a reduced-resolution figure.
+FIGURE_TIMEOUT = float(os.getenv("FIGURE_TIMEOUT", "10"))
+
+# Maximum number of rows plotted by the reduced-resolution fallback.
+FALLBACK_ROWS = int(os.getenv("FIGURE_FALLBACK_ROWS", "2000"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Per pool: number of jobs in flight that have not missed their deadline.
+_executor_jobs = {}
+
+# Number of jobs submitted to the pool that have not finished yet.
+_busy_workers = 0
+
+
+def _claim_executor():
+    """
+    Returns the shared process pool, creating it on first use, and counts one more job on it.
+
+    Every claim must be ended with _release_executor.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=FIGURE_WORKERS)
+            _executor_jobs[_executor] = 0
+        _executor_jobs[_executor] += 1
+        return _executor
+
+
+def _release_executor(executor, retire=False):
+    """
+    Ends a job's claim on a process pool.
+
+    Parameters:
+        executor: The pool returned by _claim_executor.
+        retire: Whether the job overran its deadline or found the pool broken. A retired pool
+            receives no new jobs; later calls start a fresh one.
+
+    A retired pool is shut down once no job that is still within its deadline runs on it, and its
+    workers are terminated then. This stops overrunning jobs without breaking other users' jobs.
+    """
+    global _executor
+    with _executor_lock:
+        _executor_jobs[executor] -= 1
+        if retire and _executor is executor:
+            _executor = None
+        if _executor is executor or _executor_jobs[executor] > 0:
+            return
+        del _executor_jobs[executor]
+    # ProcessPoolExecutor has no public way to stop a running job, so terminate its workers directly
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def _acquire_worker():
+    """
+    Claims a free worker slot.
+
+    Returns:
+        True if a slot was claimed, False if every worker is already busy.
+    """
+    global _busy_workers
+    with _executor_lock:
+        if _busy_workers >= FIGURE_WORKERS:
+            return False
+        _busy_workers += 1
+        return True
+
+
+def _release_worker():
+    """
+    Returns a worker slot claimed by _acquire_worker.
+    """
+    global _busy_workers
+    with _executor_lock:
+        _busy_workers -= 1
+
+
+def required_columns(data, x_axis, y_axis, z_axis):
+    """
+    Lists the distinct axis columns that exist in the data.
+
+    Parameters:
+        data: The input DataFrame.
+        x_axis, y_axis, z_axis: Column names chosen for the graph (may be None).
+
+    Returns:
+        A list of column names, in axis order and without duplicates.
+    """
+    columns = []
+    for column in (x_axis, y_axis, z_axis):
+        if column is not None and column in data.columns and column not in columns:
+            columns.append(column)
+    return columns
+
+
+def encode_columns(frame):
+    """
+    Encodes a DataFrame as an Arrow IPC stream for transfer to a worker process.
+
+    Parameters:
+        frame: The DataFrame holding only the required columns.
+
+    Returns:
+        The Arrow IPC bytes, or the DataFrame itself if Arrow cannot represent a column
+        (e.g. object columns with mixed types), in which case it is pickled as usual.
+    """
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return frame
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def decode_columns(payload):
+    """
+    Decodes the output of encode_columns back into a DataFrame.
+    """
+    if isinstance(payload, bytes):
+        # py_buffer wraps the bytes without copying them
+        with pa.ipc.open_stream(pa.py_buffer(payload)) as reader:
+            return reader.read_pandas()
+    return payload
+
+
+def reduce_resolution(frame, max_rows=FALLBACK_ROWS):
+    """
+    Picks evenly spaced rows so that at most max_rows remain, preserving row order.
+    """
+    if len(frame) <= max_rows:
+        return frame
+    positions = np.linspace(0, len(frame) - 1, max_rows).astype(int)
+    return frame.iloc[positions]
+
+
+def _render_html(payload, graph_type, x_axis, y_axis, z_axis, title):
+    """
+    Worker entry point: builds the figure and serializes it to an HTML fragment.
+    """
+    frame = decode_columns(payload)
+    fig = build_figure(frame, graph_type, x_axis, y_axis, z_axis, title)
+    return fig.to_html(full_html=False, include_plotlyjs="cdn")
+
+
+def render_graph_html(data, graph_type, x_axis, y_axis, z_axis, title, timeout=FIGURE_TIMEOUT):
+    """
+    Renders a graph to HTML in the process pool, with a deadline.
+
+    Parameters:
+        data: The input DataFrame.
+        graph_type: The type of graph to generate.
+        x_axis, y_axis, z_axis: Columns chosen by generate_graph_spec.
+        title: The graph title.
+        timeout: Seconds to wait for the worker.
+
+    Returns:
+        A (html, degraded) tuple with the figure as an HTML fragment. If every worker is busy, the
+        worker misses the deadline or the pool breaks, a figure built from at most FALLBACK_ROWS
+        rows is rendered in the calling process instead and degraded is True. A pool whose worker missed the deadline is replaced, and killed
+        once the jobs still within their deadline have finished, so overrunning jobs cannot hold
+        workers that later requests are waiting for.
+    """
+    frame = data[required_columns(data, x_axis, y_axis, z_axis)]
+    if not _acquire_worker():
+        print("All figure workers are busy, falling back to reduced resolution")
+    else:
+        try:
+            payload = encode_columns(frame)
+            # A pool can break between being claimed and used, so a failed submit is retried once on a fresh pool
+            for _ in range(2):
+                executor = _claim_executor()
+                retire = False
+                try:
+                    try:
+                        future = executor.submit(_render_html, payload, graph_type, x_axis, y_axis, z_axis, title)
+                    except RuntimeError as error:
+                        print(f"Figure worker pool rejected the job ({error}), retrying on a fresh pool")
+                        retire = True
+                        continue
+                    return future.result(timeout=timeout), False
+                except FutureTimeoutError:
+                    print(f"Figure rendering exceeded {timeout}s, falling back to reduced resolution")
+                    retire = True
+                    break
+                except BrokenProcessPool:
+                    print("Figure worker pool broke, falling back to reduced resolution")
+                    retire = True
+                    break
+                finally:
+                    _release_executor(executor, retire)
+        finally:
+            _release_worker()
+
+    reduced = reduce_resolution(frame)
+    if len(reduced) < len(frame):
+        title = f"{title} (sampled {len(reduced)} of {len(frame)} rows)"
+    return _render_html(reduced, graph_type, x_axis, y_axis, z_axis, title), True
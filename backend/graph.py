@@ -7,6 +7,7 @@ import os
 from dotenv import load_dotenv
 import plotly.graph_objects as go
 import numpy as np
+from token_budget import Section, complete
 
 """
 This module handles graph recommendations and generation based on input data.
@@ -89,16 +90,13 @@ def get_graph_recommendation(data):
     validates the recommended chart type using validate_graph_type, and returns the valid chart type.
     """
     print(data)
-    prompt = (
-        f"Recommend a graph for this data to best represent the data: {data}. "
-        f"Here are your responce options: {CHART_OPTIONS} but you cannot use these options: {invalid_chart_types}. "
+    prompt = [
+        "Recommend a graph for this data to best represent the data: ",
+        Section(str(data)),
+        f". Here are your responce options: {CHART_OPTIONS} but you cannot use these options: {invalid_chart_types}. "
         "only use one word from the list as your response"
-    )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    )
+    ]
+    response = complete(client, "graph_recommendation", prompt)
     print(response.choices[0].message.content)
     print("wow")
     # Validate the recommended graph type; if valid, return it.
@@ -204,15 +202,12 @@ def validate_graph_type(data, graph_type):
     if requirements == "Invalid Chart Type":
         return False
 
-    prompt = (
-        f"Does the data meet these requirements for a {graph_type}: {requirements}? "
-        f"Here is the data {data}. Provide a yes or no answer without extra characters, do not put a period."
-    )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    )
+    prompt = [
+        f"Does the data meet these requirements for a {graph_type}: {requirements}? Here is the data ",
+        Section(str(data)),
+        ". Provide a yes or no answer without extra characters, do not put a period."
+    ]
+    response = complete(client, "graph_validation", prompt)
     answer = response.choices[0].message.content.strip().lower()
     print("is it valid? " + answer)
     return answer == "yes"
@@ -251,18 +246,18 @@ def find_best_columns(data, graph_type):
     if requirements == "Invalid Chart Type":
         return None, None
 
-    prompt = (
-        f"Given the data {data} and the graph type {graph_type}, which columns out of these {data.columns} should be used for the graph "
-        f"based on these requirements: {requirements}? Do not choose columns that matches in the following list: {chart_memory}, "
-        "Try to pick columns that can lead to intreasting graphs. Provide ONLY the column names comma seperated format "
+    # Older chart memory entries are the least valuable context, then the data preview
+    prompt = [
+        "Given the data ",
+        Section(str(data), priority=1),
+        f" and the graph type {graph_type}, which columns out of these {data.columns} should be used for the graph "
+        f"based on these requirements: {requirements}? Do not choose columns that matches in the following list: ",
+        Section(str(chart_memory), priority=0, keep="tail"),
+        ", Try to pick columns that can lead to intreasting graphs. Provide ONLY the column names comma seperated format "
         "(Ex: column_name, column_name, column_name) infering that if it's only two columns that the format is x y and if there's only one needed just state the name of the column without any other characters in the answer. "
         "do not put the answer in quotes or add a period"
-    )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    )
+    ]
+    response = complete(client, "graph_columns", prompt)
     print(response.choices[0].message.content)
     columns = response.choices[0].message.content.strip()
     if columns.lower() == "none":
@@ -272,19 +267,19 @@ def find_best_columns(data, graph_type):
     return columns_list
 
 
-def generate_graph(data, graph_type):
+def generate_graph_spec(data, graph_type):
     """
-    Generates a graph using Plotly based on the provided data and graph type.
+    Chooses the columns and title for a graph of the given type.
 
     Parameters:
         data: The input data (e.g., a DataFrame) for visualization.
         graph_type: The type of graph to generate.
 
     Returns:
-        A Plotly figure object representing the generated graph, or None if no suitable columns are found.
+        A tuple (x_axis, y_axis, z_axis, title), or None if no suitable columns are found.
 
-    This function determines the best columns to use, generates a graph title using OpenAI's API,
-    and produces the appropriate chart using Plotly based on the graph type.
+    This function determines the best columns to use and generates a graph title using OpenAI's API.
+    It does not build the figure itself, so the result can be handed to build_figure in another process.
     """
     columns = find_best_columns(data, graph_type)
     invalid_chart_types.clear()
@@ -296,22 +291,41 @@ def generate_graph(data, graph_type):
     y_axis = columns[1] if len(columns) > 1 else None
     z_axis = columns[2] if len(columns) > 2 else None
 
-    prompt = (
-        f"Generate a title for a graph of {graph_type} type with this data: {data} that has an x-axis of {x_axis} and a y-axis of {y_axis}"
-    )
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    )
+    prompt = [
+        f"Generate a title for a graph of {graph_type} type with this data: ",
+        Section(str(data)),
+        f" that has an x-axis of {x_axis} and a y-axis of {y_axis}"
+    ]
+    response = complete(client, "graph_title", prompt)
     title = response.choices[0].message.content.strip()
 
     # Append the used columns to chart memory for future reference
     chart_memory.append(f"Graph type {graph_type} data used: col1 = {x_axis} col2 = {y_axis} col3 = {z_axis}")
     print("chart mem", chart_memory)
 
+    return x_axis, y_axis, z_axis, title
+
+
+def build_figure(data, graph_type, x_axis, y_axis, z_axis, title):
+    """
+    Builds a Plotly figure for an already chosen graph type, columns and title.
+
+    Parameters:
+        data: The input data (e.g., a DataFrame). Only the named axis columns are read.
+        graph_type: The type of graph to generate.
+        x_axis: Column for the x-axis.
+        y_axis: Column for the y-axis, or None.
+        z_axis: Column for the third dimension, or None.
+        title: The graph title.
+
+    Returns:
+        A Plotly figure object representing the generated graph.
+
+    This function makes no API calls, so it can run inside a worker process (see figure_pool).
+    """
     if graph_type == "Line":
-        fig = px.line(data, x=data[x_axis], y=data[y_axis], title=title)
+        color = data[z_axis] if z_axis is not None else None
+        fig = px.line(data, x=data[x_axis], y=data[y_axis], color=color, title=title)
     elif graph_type == "Bar":
         fig = px.bar(data, x=data[x_axis], y=data[y_axis], title=title)
     elif graph_type == "Histogram":
@@ -348,3 +362,22 @@ def generate_graph(data, graph_type):
         fig = px.bar(data, x=data[x_axis], y=data[y_axis], title=title)
 
     return fig
+
+
+def generate_graph(data, graph_type):
+    """
+    Generates a graph using Plotly based on the provided data and graph type.
+
+    Parameters:
+        data: The input data (e.g., a DataFrame) for visualization.
+        graph_type: The type of graph to generate.
+
+    Returns:
+        A Plotly figure object representing the generated graph, or None if no suitable columns are found.
+
+    This function combines generate_graph_spec and build_figure in the calling process.
+    """
+    spec = generate_graph_spec(data, graph_type)
+    if spec is None:
+        return None
+    return build_figure(data, graph_type, *spec)
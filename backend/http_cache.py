@@ -0,0 +1,178 @@
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+This module implements HTTP caching and compression helpers for the Flask app.
+It builds strong ETags, answers conditional requests with 304 Not Modified, keeps rendered
+figure payloads for immutable caching, and compresses responses with brotli or gzip.
+"""
+
+# Responses smaller than this many bytes are sent uncompressed.
+COMPRESS_MIN_SIZE = 1024
+
+# Content types that are worth compressing.
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/html", "text/plain"}
+
+# Encodings this module can produce, in order of preference.
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Cache-Control for payloads addressed by their content hash, which never change.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+# Cache-Control for payloads that may change but can be revalidated with their ETag.
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+# Cache-Control for degraded payloads (e.g. reduced-resolution figures), which must not be reused.
+NO_STORE_CACHE_CONTROL = "no-store"
+
+# Maximum number of rendered figure payloads kept in memory.
+FIGURE_CACHE_SIZE = 16
+
+# Least recently used cache of rendered figure payloads, keyed by ETag.
+figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+
+def etag_for(*parts):
+    """
+    Builds a strong ETag from the parts that determine a payload.
+
+    Parameters:
+        parts: Values such as the dataset hash and the chart spec; they are combined via repr.
+
+    Returns:
+        A hex digest to use as the entity tag.
+    """
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def matching_etag(etag):
+    """
+    Finds the variant of the given ETag named by the request's If-None-Match header.
+
+    Returns:
+        The ETag itself or its encoding-suffixed variant (as carried by compressed responses),
+        or None if the header names neither.
+    """
+    candidates = [etag] + [f"{etag}-{encoding}" for encoding in SUPPORTED_ENCODINGS]
+    return next((candidate for candidate in candidates if request.if_none_match.contains(candidate)), None)
+
+
+def matches_etag(etag):
+    """
+    Checks whether the request's If-None-Match header names the given ETag or one of its encoded variants.
+    """
+    return matching_etag(etag) is not None
+
+
+def not_modified(etag, cache_control=REVALIDATE_CACHE_CONTROL):
+    """
+    Builds a 304 Not Modified response for the given ETag.
+
+    The response carries the variant the client sent (e.g. "<tag>-gzip"), which is the tag
+    of the representation it has stored.
+    """
+    response = Response(status=304)
+    response.set_etag(matching_etag(etag) or etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def remember_figure(etag, payload):
+    """
+    Stores a rendered figure payload so it can be served again without re-rendering.
+    """
+    with _figure_cache_lock:
+        figure_cache[etag] = payload
+        figure_cache.move_to_end(etag)
+        if len(figure_cache) > FIGURE_CACHE_SIZE:
+            figure_cache.popitem(last=False)
+
+
+def cached_figure(etag):
+    """
+    Returns a previously rendered figure payload, or None.
+    """
+    with _figure_cache_lock:
+        if etag not in figure_cache:
+            return None
+        figure_cache.move_to_end(etag)
+        return figure_cache[etag]
+
+
+def choose_encoding():
+    """
+    Picks the preferred encoding the client accepts, or None.
+    """
+    for encoding in SUPPORTED_ENCODINGS:
+        if request.accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress_stream(chunks):
+    """
+    Gzip-compresses a streamed body chunk by chunk, flushing after each one so that
+    the client still receives every chunk as soon as it is produced.
+    """
+    compressor = zlib.compressobj(wbits=31)  # wbits=31 selects the gzip container
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """
+    Compresses a response body when the client accepts it and it is large enough.
+
+    Parameters:
+        response: The outgoing Flask response.
+
+    Returns:
+        The same response, compressed in place where applicable.
+
+    Streamed responses are gzip-compressed incrementally; others use brotli when available.
+    A strong ETag is suffixed with the encoding so each representation has its own tag.
+    """
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+
+    if response.is_streamed:
+        if request.accept_encodings["gzip"] <= 0:
+            return response
+        response.response = compress_stream(response.response)
+        response.headers.pop("Content-Length", None)
+        encoding = "gzip"
+    else:
+        encoding = choose_encoding()
+        body = response.get_data()
+        if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+            return response
+        if encoding == "br":
+            response.set_data(brotli.compress(body))
+        else:
+            response.set_data(gzip.compress(body))
+
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
@@ -0,0 +1,206 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from token_budget import Section, complete
+
+"""
+This module answers questions about the uploaded dataset with OpenAI's API.
+Batches of questions are normalized and deduplicated, then answered concurrently against
+one shared context. Short questions can optionally be packed into a single completion.
+"""
+
+# Number of completions issued concurrently for one batch.
+ASK_WORKERS = int(os.getenv("ASK_WORKERS", "8"))
+
+# Maximum number of questions accepted in one batch.
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "100"))
+
+# Questions up to this many characters are eligible for packing.
+PACK_MAX_CHARS = 120
+
+# Maximum number of questions packed into one completion.
+PACK_SIZE = 5
+
+# Matches one "<number>. <answer>" line of a packed completion.
+PACKED_ANSWER_PATTERN = re.compile(r"^\s*(\d+)[.)]\s*(.+)$")
+
+
+def normalize_question(question):
+    """
+    Produces the key used to detect duplicate questions.
+
+    Parameters:
+        question: The question text.
+
+    Returns:
+        The question lowercased, with whitespace collapsed and trailing punctuation removed.
+    """
+    return " ".join(question.split()).casefold().rstrip("?.! ")
+
+
+def deduplicate_questions(questions):
+    """
+    Groups questions that normalize to the same key.
+
+    Parameters:
+        questions: A list of question strings.
+
+    Returns:
+        A list of (question, indexes) tuples, one per distinct question, where question is the
+        first spelling seen and indexes are its positions in the input list.
+    """
+    groups = {}
+    for index, question in enumerate(questions):
+        key = normalize_question(question)
+        if not key:
+            continue
+        if key not in groups:
+            groups[key] = (question.strip(), [])
+        groups[key][1].append(index)
+    return list(groups.values())
+
+
+def build_context(summary_content, description):
+    """
+    Builds the dataset context shared by every question of a batch.
+    """
+    return f"Summary:\n{summary_content}\n\nData Summary:\n{description}"
+
+
+def answer_question(client, question, context, session=None):
+    """
+    Answers a single question against the dataset context.
+
+    Parameters:
+        client: The OpenAI client.
+        question: The question text.
+        context: The output of build_context.
+        session: The session charged for the tokens (see token_budget.current_session).
+
+    Returns:
+        The answer as markdown text.
+    """
+    prompt = [f"Question: {question}\n\n", Section(context), "\n\nAnswer:"]
+    response = complete(
+        client, "ask", prompt,
+        system="Try to answer the question in one sentence (300 tokens).",
+        session=session
+    )
+    return response.choices[0].message.content
+
+
+def answer_packed_questions(client, questions, context, session=None):
+    """
+    Answers several short questions with one completion.
+
+    Parameters:
+        client: The OpenAI client.
+        questions: A list of question strings.
+        context: The output of build_context.
+        session: The session charged for the tokens (see token_budget.current_session).
+
+    Returns:
+        A list with one answer per question, or None where the completion did not contain
+        a parseable answer for that question.
+    """
+    numbered = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, start=1))
+    prompt = [f"Questions:\n{numbered}\n\n", Section(context), "\n\nAnswers:"]
+    response = complete(
+        client, "ask_packed", prompt,
+        system=(
+            "Answer each numbered question in one sentence. "
+            "Reply with exactly one line per question in the form '<number>. <answer>'."
+        ),
+        session=session,
+        units=len(questions)
+    )
+    answers = [None] * len(questions)
+    for line in response.choices[0].message.content.splitlines():
+        match = PACKED_ANSWER_PATTERN.match(line)
+        if match and 1 <= int(match.group(1)) <= len(questions):
+            answers[int(match.group(1)) - 1] = match.group(2).strip()
+    return answers
+
+
+def pack_questions(questions, max_chars=PACK_MAX_CHARS, size=PACK_SIZE):
+    """
+    Splits questions into groups, packing short ones together.
+
+    Parameters:
+        questions: A list of question strings.
+        max_chars: Questions longer than this are always asked alone.
+        size: Maximum number of questions per group.
+
+    Returns:
+        A list of lists of positions into questions.
+    """
+    groups = []
+    short = []
+    for position, question in enumerate(questions):
+        if len(question) > max_chars:
+            groups.append([position])
+            continue
+        short.append(position)
+        if len(short) == size:
+            groups.append(short)
+            short = []
+    if short:
+        groups.append(short)
+    return groups
+
+
+def answer_batch(client, questions, context, pack=False, session=None):
+    """
+    Answers a batch of questions concurrently, yielding results as they finish.
+
+    Parameters:
+        client: The OpenAI client.
+        questions: A list of question strings, possibly with duplicates.
+        context: The output of build_context, computed once for the whole batch.
+        pack: Whether to pack short questions into shared completions.
+        session: The session charged for the tokens; worker threads have no request to derive it from.
+
+    Yields:
+        One dict per input question with its 'index', 'question', and either 'answer'
+        (markdown text) or 'error'. Duplicate questions receive the same answer, and blank
+        questions are reported as errors first.
+
+    If the caller stops iterating (e.g. the client disconnected), queued completions are cancelled.
+    """
+    for index, question in enumerate(questions):
+        if not normalize_question(question):
+            yield {"index": index, "question": question, "error": "No question provided"}
+
+    distinct = deduplicate_questions(questions)
+    texts = [question for question, _ in distinct]
+
+    def answer_group(positions):
+        if len(positions) == 1:
+            return {positions[0]: answer_question(client, texts[positions[0]], context, session)}
+        answers = answer_packed_questions(client, [texts[position] for position in positions], context, session)
+        # Fall back to individual completions for anything the packed reply missed
+        return {
+            position: answer if answer is not None else answer_question(client, texts[position], context, session)
+            for position, answer in zip(positions, answers)
+        }
+
+    groups = pack_questions(texts) if pack else [[position] for position in range(len(texts))]
+    executor = ThreadPoolExecutor(max_workers=ASK_WORKERS)
+    try:
+        futures = {executor.submit(answer_group, positions): positions for positions in groups}
+        for future in as_completed(futures):
+            try:
+                results = {position: {"answer": answer} for position, answer in future.result().items()}
+            except Exception as error:
+                results = {position: {"error": str(error)} for position in futures[future]}
+            for position, result in results.items():
+                _, indexes = distinct[position]
+                for index in indexes:
+                    yield {"index": index, "question": questions[index], **result}
+    except GeneratorExit:
+        # The batch was abandoned: do not pay for completions nobody will read
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        executor.shutdown(wait=False)
@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+import pytest
+
+from dataset import parse_filter, select_rows
+from timeseries import index_time_columns
+
+DATASETS = os.path.join(os.path.dirname(__file__), "..", "..", "example_datasets")
+AIR_QUALITY = "Air_Quality.csv"
+ANXIETY = "Indicators_of_Anxiety_or_Depression_Based_on_Reported_Frequency_of_Symptoms_During_Last_7_Days.csv"
+
+
+def load(name):
+    return pd.read_csv(os.path.join(DATASETS, name), low_memory=False)
+
+
+@pytest.fixture(scope="module")
+def air_quality():
+    data = load(AIR_QUALITY)
+    return data, index_time_columns(data, AIR_QUALITY)
+
+
+def query(data, data_hash, time_columns, sort=None, ascending=True, filters=()):
+    parsed = [parse_filter(data, expression, time_columns) for expression in filters]
+    return data.iloc[select_rows(data, data_hash, sort, ascending, parsed, time_columns)]
+
+
+def test_sort_date_column_chronologically(air_quality):
+    data, time_columns = air_quality
+    ascending = pd.to_datetime(query(data, AIR_QUALITY, time_columns, "Start_Date")["Start_Date"], format="%m/%d/%Y")
+    assert ascending.is_monotonic_increasing
+    assert ascending.iloc[0] == pd.Timestamp("2005-01-01")
+
+    descending = pd.to_datetime(
+        query(data, AIR_QUALITY, time_columns, "Start_Date", ascending=False)["Start_Date"], format="%m/%d/%Y"
+    )
+    assert descending.is_monotonic_decreasing
+    assert descending.iloc[0] == pd.Timestamp("2022-06-01")
+
+
+def test_sort_descending_keeps_missing_dates_last():
+    data = pd.DataFrame({"Start_Date": ["01/02/2020", None, "12/31/2019", "01/02/2020"], "Value": [1, 2, 3, 4]})
+    time_columns = index_time_columns(data, "missing-dates")
+    for ascending, expected in ((True, [3, 1, 4, 2]), (False, [1, 4, 3, 2])):
+        rows = query(data, "missing-dates", time_columns, "Start_Date", ascending)
+        assert list(rows["Value"]) == expected
+
+
+def test_filter_date_column_by_timestamp(air_quality):
+    data, time_columns = air_quality
+    rows = query(data, AIR_QUALITY, time_columns, filters=["Start_Date:gt:2020-01-01"])
+    assert len(rows)
+    assert (pd.to_datetime(rows["Start_Date"], format="%m/%d/%Y") > pd.Timestamp("2020-01-01")).all()
+
+
+def test_filter_date_column_by_exact_label(air_quality):
+    data, time_columns = air_quality
+    rows = query(data, AIR_QUALITY, time_columns, filters=["Time Period:eq:Summer 2014"])
+    assert len(rows) == (data["Time Period"] == "Summer 2014").sum()
+    rows = query(data, AIR_QUALITY, time_columns, filters=["Time Period:ne:Summer 2014"])
+    assert len(rows) == (data["Time Period"] != "Summer 2014").sum()
+
+
+def test_filter_date_range_label():
+    data = load(ANXIETY)
+    time_columns = index_time_columns(data, ANXIETY)
+    rows = query(data, ANXIETY, time_columns, filters=["Time Period Label:eq:Apr 23 - May 5, 2020"])
+    assert len(rows) == (data["Time Period Label"] == "Apr 23 - May 5, 2020").sum() > 0
+
+
+def test_filter_rejects_invalid_values(air_quality):
+    data, time_columns = air_quality
+    with pytest.raises(ValueError, match="is not a date"):
+        parse_filter(data, "Start_Date:gt:soon", time_columns)
+    with pytest.raises(ValueError, match="is not numeric"):
+        parse_filter(data, "Data Value:lt:high", time_columns)
+    with pytest.raises(ValueError, match="Unknown column"):
+        parse_filter(data, "Missing:eq:1", time_columns)
@@ -0,0 +1,74 @@
+import re
+import threading
+from types import SimpleNamespace
+
+from questions import answer_batch, answer_packed_questions, deduplicate_questions, normalize_question, pack_questions
+
+
+class FakeClient:
+    """
+    Stands in for the OpenAI client, replying with a fixed text or one built from the prompt.
+    """
+
+    def __init__(self, reply):
+        self.chat = SimpleNamespace(completions=self)
+        self.reply = reply
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    def create(self, messages, **request):
+        prompt = messages[-1]["content"]
+        with self.lock:
+            self.prompts.append(prompt)
+        return SimpleNamespace(
+            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5),
+            choices=[SimpleNamespace(finish_reason="stop", message=SimpleNamespace(content=self.reply(prompt)))],
+        )
+
+
+def echo_question(prompt):
+    return "Answer to " + re.search(r"Question: (.*)", prompt).group(1)
+
+
+def test_normalize_question():
+    assert normalize_question("  What is   the MEAN?? ") == "what is the mean"
+    assert normalize_question(" ?! ") == ""
+
+
+def test_deduplicate_questions_groups_spellings():
+    questions = ["What is the mean?", "", "what is  the mean", "How many rows?", "   "]
+    assert deduplicate_questions(questions) == [("What is the mean?", [0, 2]), ("How many rows?", [3])]
+
+
+def test_pack_questions_keeps_long_questions_alone():
+    questions = ["short"] * 7 + ["long " * 30]
+    assert pack_questions(questions, size=5) == [[0, 1, 2, 3, 4], [7], [5, 6]]
+
+
+def test_packed_answers_are_matched_by_number():
+    client = FakeClient(lambda prompt: "Here you go:\n2) Second\n1. First\n7. Out of range")
+    answers = answer_packed_questions(client, ["a?", "b?", "c?"], "context", session="s")
+    assert answers == ["First", "Second", None]
+
+
+def test_answer_batch_reports_blank_questions_and_shares_duplicates():
+    client = FakeClient(echo_question)
+    results = list(answer_batch(client, ["Mean?", " ", "mean", "Rows?"], "context", session="s"))
+    by_index = {result["index"]: result for result in results}
+    assert results[0] == {"index": 1, "question": " ", "error": "No question provided"}
+    assert by_index[0]["answer"] == by_index[2]["answer"] == "Answer to Mean?"
+    assert by_index[3]["answer"] == "Answer to Rows?"
+    assert len(client.prompts) == 2
+
+
+def test_answer_batch_packs_and_falls_back_for_missing_answers():
+    def reply(prompt):
+        if prompt.startswith("Questions:"):
+            return "1. Packed first"
+        return echo_question(prompt)
+
+    client = FakeClient(reply)
+    results = list(answer_batch(client, ["First?", "Second?"], "context", pack=True, session="s"))
+    answers = {result["index"]: result["answer"] for result in results}
+    assert answers == {0: "Packed first", 1: "Answer to Second?"}
+    assert len(client.prompts) == 2
@@ -0,0 +1,85 @@
+import os
+
+import pandas as pd
+import pytest
+
+from timeseries import MAX_LINE_POINTS, index_time_columns, prepare_line, resample_line
+
+DATASETS = os.path.join(os.path.dirname(__file__), "..", "..", "example_datasets")
+AIR_QUALITY = "Air_Quality.csv"
+IHME = "IHME_GBD_2010_MORTALITY_AGE_SPECIFIC_BY_COUNTRY_1970_2010.csv"
+ANXIETY = "Indicators_of_Anxiety_or_Depression_Based_on_Reported_Frequency_of_Symptoms_During_Last_7_Days.csv"
+
+
+def load(name):
+    return pd.read_csv(os.path.join(DATASETS, name), low_memory=False)
+
+
+@pytest.fixture(scope="module")
+def air_quality():
+    return load(AIR_QUALITY)
+
+
+@pytest.fixture(scope="module")
+def anxiety():
+    return load(ANXIETY)
+
+
+def test_air_quality_date_columns(air_quality):
+    index = index_time_columns(air_quality, AIR_QUALITY)
+    assert index["Start_Date"][2] == "time"
+    assert index["Time Period"][2] == "time"
+    assert "Data Value" not in index
+
+    values, order, _ = index["Start_Date"]
+    assert pd.Timestamp(values[order[0]]) == pd.Timestamp("2005-01-01")
+    assert pd.Timestamp(values[order[-1]]) == pd.Timestamp("2022-06-01")
+
+
+def test_air_quality_time_period_falls_back_to_year(air_quality):
+    values, _, _ = index_time_columns(air_quality, AIR_QUALITY)["Time Period"]
+    parsed = pd.Series(values, index=air_quality.index)
+    # "Summer 2014" and "Annual Average 2009" have no full date, only a year
+    assert (parsed[air_quality["Time Period"] == "Summer 2014"] == pd.Timestamp("2014-01-01")).all()
+    assert (parsed[air_quality["Time Period"] == "Annual Average 2009"] == pd.Timestamp("2009-01-01")).all()
+
+
+def test_air_quality_start_date_resamples_within_budget(air_quality):
+    frame, label = resample_line(air_quality, AIR_QUALITY, "Start_Date", "Data Value")
+    assert label in ("mean per day", "mean per month")
+    assert len(frame) <= MAX_LINE_POINTS
+    assert frame["Start_Date"].is_monotonic_increasing
+
+
+def test_ihme_year_column_is_yearly():
+    data = load(IHME)
+    assert index_time_columns(data, IHME)["Year"][2] == "time"
+    frame, x_axis, y_axis, z_axis, title = prepare_line(data, IHME, "Year", "Death Rate Per 100,000", "Sex", "Deaths")
+    assert title == "Deaths (mean per year)"
+    assert z_axis == "Sex"
+    assert frame["Year"].dt.year.min() == 1970
+    assert frame["Year"].dt.year.max() == 2010
+
+
+def test_anxiety_time_period_is_binned_sequence(anxiety):
+    index = index_time_columns(anxiety, ANXIETY)
+    assert index["Time Period"][2] == "sequence"
+
+    frame, label = resample_line(anxiety, ANXIETY, "Time Period", "Value")
+    assert label == "mean per step"
+    assert sorted(frame["Time Period"]) == list(range(1, 73))
+
+    frame, label = resample_line(anxiety, ANXIETY, "Time Period", "Value", max_points=10)
+    assert label == "mean per 8 steps"
+    assert len(frame) <= 10
+
+
+def test_anxiety_date_range_uses_its_start(anxiety):
+    values, _, kind = index_time_columns(anxiety, ANXIETY)["Time Period Label"]
+    parsed = pd.Series(values, index=anxiety.index)
+    assert kind == "time"
+    assert parsed.notna().all()
+    # The start of the range, not January 1 of its year
+    assert (parsed[anxiety["Time Period Label"] == "Apr 23 - May 5, 2020"] == pd.Timestamp("2020-04-23")).all()
+    assert (parsed[anxiety["Time Period Label"] == "June 4 - June 9, 2020"] == pd.Timestamp("2020-06-04")).all()
+    assert (parsed[anxiety["Time Period Label"] == "Dec 22, 2020 - Jan 5, 2021"] == pd.Timestamp("2020-12-22")).all()
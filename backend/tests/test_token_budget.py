@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+import token_budget
+from token_budget import (CALL_SITES, MIN_OUTPUT_SAMPLES, OUTPUT_HISTORY_SIZE, TRUNCATION_MARKER, Section,
+                          TokenQuotaExceeded, choose_max_tokens, complete, estimate_tokens, fit_prompt)
+
+
+class FakeClient:
+    """
+    Stands in for the OpenAI client: records requests and replies with fixed usage.
+    """
+
+    def __init__(self, prompt_tokens=50, completion_tokens=20, finish_reason="stop", error=None):
+        self.chat = SimpleNamespace(completions=self)
+        self.requests = []
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.finish_reason = finish_reason
+        self.error = error
+
+    def create(self, **request):
+        self.requests.append(request)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(
+            usage=SimpleNamespace(prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens),
+            choices=[SimpleNamespace(finish_reason=self.finish_reason, message=SimpleNamespace(content="ok"))],
+        )
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(token_budget, "_calibration", 1.0)
+    monkeypatch.setattr(token_budget, "_outputs", {site: deque(maxlen=OUTPUT_HISTORY_SIZE) for site in CALL_SITES})
+    monkeypatch.setattr(token_budget, "_stats",
+                        {site: dict.fromkeys(stats, 0) for site, stats in token_budget._stats.items()})
+    monkeypatch.setattr(token_budget, "_sessions", {})
+
+
+def used(session):
+    return token_budget._sessions[session][1]
+
+
+def test_fit_prompt_keeps_prompt_within_budget():
+    prompt, trimmed = fit_prompt(["Question: ", Section("short context")], budget=100)
+    assert prompt == "Question: short context"
+    assert not trimmed
+
+
+def test_fit_prompt_trims_lowest_priority_first():
+    memory = Section("old chart " * 200, priority=0)
+    data = Section("data row " * 200, priority=1)
+    prompt, trimmed = fit_prompt(["Pick columns: ", memory, data], budget=estimate_tokens("data row " * 200) + 20)
+    assert trimmed
+    assert prompt.startswith("Pick columns: ")
+    assert "data row " * 200 in prompt
+    assert prompt.count("old chart") < 200
+    assert estimate_tokens(prompt) <= estimate_tokens("data row " * 200) + 20
+
+
+def test_fit_prompt_keeps_tail_of_tail_sections():
+    text = "".join(f"entry {number}; " for number in range(200))
+    prompt, trimmed = fit_prompt([Section(text, keep="tail")], budget=50)
+    assert trimmed
+    assert prompt.startswith(TRUNCATION_MARKER.strip())
+    assert prompt.endswith("entry 199; ")
+    assert "entry 0;" not in prompt
+
+    prompt, _ = fit_prompt([Section(text)], budget=50)
+    assert prompt.startswith("entry 0; ")
+    assert prompt.endswith(TRUNCATION_MARKER)
+
+
+def test_choose_max_tokens_uses_cap_until_enough_samples():
+    token_budget._outputs["ask"].extend([10] * (MIN_OUTPUT_SAMPLES - 1))
+    assert choose_max_tokens("ask") == CALL_SITES["ask"]["max_tokens"]
+    assert choose_max_tokens("ask_packed", units=3) == CALL_SITES["ask_packed"]["max_tokens"] * 3
+
+
+def test_choose_max_tokens_clamps_percentile():
+    token_budget._outputs["ask"].extend([100] * MIN_OUTPUT_SAMPLES)
+    assert choose_max_tokens("ask") == 125
+    token_budget._outputs["ask"].clear()
+    token_budget._outputs["ask"].extend([10] * MIN_OUTPUT_SAMPLES)
+    assert choose_max_tokens("ask") == CALL_SITES["ask"]["min_tokens"]
+    token_budget._outputs["ask"].clear()
+    token_budget._outputs["ask"].extend([1000] * MIN_OUTPUT_SAMPLES)
+    assert choose_max_tokens("ask") == CALL_SITES["ask"]["max_tokens"]
+
+
+def test_max_tokens_recovers_after_truncated_outputs():
+    token_budget._outputs["ask"].extend([10] * MIN_OUTPUT_SAMPLES)
+    assert choose_max_tokens("ask") == CALL_SITES["ask"]["min_tokens"]
+    client = FakeClient(completion_tokens=CALL_SITES["ask"]["min_tokens"], finish_reason="length")
+    for _ in range(2):
+        complete(client, "ask", ["question"], session="s")
+    assert client.requests[0]["max_tokens"] == CALL_SITES["ask"]["min_tokens"]
+    assert choose_max_tokens("ask") == CALL_SITES["ask"]["max_tokens"]
+    assert token_budget._stats["ask"]["truncated_outputs"] == 2
+
+
+def test_complete_replaces_reservation_with_actual_usage():
+    client = FakeClient(prompt_tokens=50, completion_tokens=20)
+    complete(client, "ask", ["question"], session="s")
+    assert used("s") == 70
+    assert token_budget._stats["ask"]["calls"] == 1
+
+
+def test_complete_releases_reservation_when_call_fails():
+    client = FakeClient(error=RuntimeError("API unavailable"))
+    with pytest.raises(RuntimeError):
+        complete(client, "ask", ["question"], session="s")
+    assert used("s") == 0
+    assert token_budget._stats["ask"]["calls"] == 0
+
+
+def test_quota_rejects_calls_over_the_limit(monkeypatch):
+    monkeypatch.setattr(token_budget, "SESSION_TOKEN_QUOTA", 100)
+    client = FakeClient()
+    with pytest.raises(TokenQuotaExceeded):
+        complete(client, "ask", ["question"], session="s")
+    assert client.requests == []
+    assert used("s") == 0
+
+
+def test_concurrent_calls_cannot_overshoot_quota(monkeypatch):
+    reserved = token_budget.estimate_prompt_tokens([{"role": "user", "content": "question"}]) \
+        + CALL_SITES["ask"]["max_tokens"]
+    monkeypatch.setattr(token_budget, "SESSION_TOKEN_QUOTA", 5 * reserved)
+    release = threading.Event()
+
+    class SlowClient(FakeClient):
+        def create(self, **request):
+            release.wait(5)
+            return super().create(**request)
+
+    client = SlowClient()
+    rejected = []
+
+    def call():
+        try:
+            complete(client, "ask", ["question"], session="s")
+        except TokenQuotaExceeded:
+            rejected.append(True)
+
+    threads = [threading.Thread(target=call) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    # Hold the admitted calls in flight until every other call was turned away
+    deadline = time.monotonic() + 5
+    while len(rejected) < 15 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(rejected) == 15
+    assert len(client.requests) == 5
+    assert used("s") == 5 * 70
+
+
+def test_token_metrics_reports_aggregates_and_own_session():
+    complete(FakeClient(), "ask", ["question"], session="a")
+    complete(FakeClient(), "ask", ["question"], session="b")
+    metrics = token_budget.token_metrics("a")
+    assert metrics["sessions"] == {"tracked": 2, "tokens_used": 140}
+    assert metrics["session"]["tokens_used"] == 70
+    assert "b" not in str(metrics["session"])
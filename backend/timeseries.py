@@ -0,0 +1,289 @@
+import math
+import re
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+"""
+This module prepares Line chart data for date and sequence columns.
+Temporal columns are detected and parsed once when a dataset is uploaded, together with a
+cached sort order. Line charts on those columns are aggregated per day, month or year, or per
+bin of an integer sequence (and optionally per group) with vectorized pandas operations.
+"""
+
+# Maximum number of points per line after resampling.
+MAX_LINE_POINTS = 500
+
+# Grouping columns with more distinct values than this are ignored.
+MAX_LINE_GROUPS = 20
+
+# Share of sampled values that must parse for a text column to count as temporal.
+MIN_PARSE_RATE = 0.9
+
+# Number of values sampled when testing whether a text column is temporal.
+DETECTION_SAMPLE_SIZE = 200
+
+# Resampling frequencies from finest to coarsest, as (label, pandas period code).
+FREQUENCIES = [("day", "D"), ("month", "M"), ("year", "Y")]
+
+# Date formats tried in order: one format inferred from the first value, any ISO 8601 variant,
+# then per-value parsing, which is the slowest.
+DATE_FORMATS = [None, "ISO8601", "mixed"]
+
+# Column names that suggest a numeric column holds years.
+YEAR_NAME_PATTERN = re.compile(r"year|period|yr", re.IGNORECASE)
+
+# Column names that suggest an integer column numbers consecutive time steps.
+SEQUENCE_NAME_PATTERN = re.compile(r"time|period|week|month|day|step|seq|wave|phase|quarter", re.IGNORECASE)
+
+# Four-digit years embedded in text such as "Summer 2014" or "Annual Average 2009".
+YEAR_VALUE_PATTERN = r"\b(1[89]\d{2}|2[01]\d{2})\b"
+
+# Separator of date ranges such as "Apr 23 - May 5, 2020".
+RANGE_SEPARATOR_PATTERN = r"\s+(?:-|–|to)\s+"
+
+# Number of datasets whose time indexes are kept in memory.
+TIME_INDEX_CACHE_SIZE = 4
+
+# Least recently used cache of time indexes, keyed by dataset hash.
+_time_indexes = OrderedDict()
+_time_indexes_lock = threading.Lock()
+
+
+def _parse_dates(values, sample):
+    """
+    Parses text as dates with the first format in DATE_FORMATS that fits the sample.
+
+    Returns:
+        A datetime64 Series aligned with values, or None if no format fits.
+    """
+    for date_format in DATE_FORMATS:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            if pd.to_datetime(sample, format=date_format, errors="coerce").notna().mean() >= MIN_PARSE_RATE:
+                return pd.to_datetime(values, format=date_format, errors="coerce")
+    return None
+
+
+def _range_starts(values):
+    """
+    Reduces date ranges such as "Apr 23 - May 5, 2020" to their start, "Apr 23 2020".
+
+    A start without a year borrows the year written elsewhere in the range.
+    """
+    starts = values.str.split(RANGE_SEPARATOR_PATTERN, n=1, regex=True).str[0].str.strip()
+    years = values.str.extract(YEAR_VALUE_PATTERN, expand=False)
+    missing_year = starts.str.extract(YEAR_VALUE_PATTERN, expand=False).isna() & years.notna()
+    return starts.where(~missing_year, starts + " " + years)
+
+
+def _is_sequence(values):
+    """
+    Checks whether an integer column numbers consecutive time steps, e.g. a week or period number.
+    """
+    non_null = values.dropna()
+    if not SEQUENCE_NAME_PATTERN.search(str(values.name)) or non_null.nunique() < 2:
+        return False
+    if not (non_null % 1 == 0).all():
+        return False
+    # Steps may repeat per group and a few may be missing, but the values must cover their range densely
+    return non_null.max() - non_null.min() + 1 <= 2 * non_null.nunique()
+
+
+def parse_time_column(values):
+    """
+    Parses a column as timestamps or as a step sequence if it is temporal.
+
+    Parameters:
+        values: A pandas Series.
+
+    Returns:
+        A (parsed, kind) tuple, or None if the column is not temporal. For kind 'time', parsed is a
+        datetime64 Series of dates, years or date range starts; for kind 'sequence', parsed is a
+        float Series of integer step numbers.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, "time"
+    if pd.api.types.is_bool_dtype(values):
+        return None
+    if pd.api.types.is_numeric_dtype(values):
+        non_null = values.dropna()
+        if (
+            YEAR_NAME_PATTERN.search(str(values.name))
+            and len(non_null)
+            and (non_null % 1 == 0).all()
+            and non_null.between(1000, 2999).all()
+        ):
+            return pd.to_datetime(values.astype("Int64").astype(str), format="%Y", errors="coerce"), "time"
+        if _is_sequence(values):
+            return values.astype(float), "sequence"
+        return None
+    if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+        return None
+
+    sample = values.dropna().astype(str).head(DETECTION_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+    # Text that is really numeric (e.g. IDs stored as strings) is not a date
+    if pd.to_numeric(sample, errors="coerce").notna().mean() >= MIN_PARSE_RATE:
+        return None
+    parsed = _parse_dates(values, sample)
+    if parsed is None and sample.str.contains(RANGE_SEPARATOR_PATTERN, regex=True).mean() >= MIN_PARSE_RATE:
+        # Range labels mix spellings (e.g. "Apr 23" and "June 4"), so parse each distinct start on its own
+        starts = _range_starts(values.astype(str))
+        distinct = pd.Series(starts.dropna().unique())
+        parsed_starts = pd.to_datetime(distinct, format="mixed", errors="coerce")
+        if parsed_starts.notna().mean() >= MIN_PARSE_RATE:
+            parsed = starts.map(dict(zip(distinct, parsed_starts))).astype("datetime64[ns]")
+    if parsed is not None:
+        return parsed, "time"
+    # Only text without a full date falls back to its year, e.g. "Summer 2014"
+    if sample.str.extract(YEAR_VALUE_PATTERN, expand=False).notna().mean() >= MIN_PARSE_RATE:
+        years = values.astype(str).str.extract(YEAR_VALUE_PATTERN, expand=False)
+        return pd.to_datetime(years, format="%Y", errors="coerce"), "time"
+    return None
+
+
+def index_time_columns(data, data_hash):
+    """
+    Detects the temporal columns of a dataset and caches their parsed values and sort order.
+
+    Parameters:
+        data: The uploaded DataFrame.
+        data_hash: The dataset identifier used as cache key.
+
+    Returns:
+        A dict mapping column name to a (values, order, kind) tuple, where values is a numpy
+        array (datetime64 for kind 'time', float for kind 'sequence') and order holds the row
+        positions sorted by it.
+    """
+    with _time_indexes_lock:
+        if data_hash in _time_indexes:
+            _time_indexes.move_to_end(data_hash)
+            return _time_indexes[data_hash]
+    index = {}
+    for column in data.columns:
+        result = parse_time_column(data[column])
+        if result is None:
+            continue
+        parsed, kind = result
+        values = parsed.to_numpy(dtype="datetime64[ns]" if kind == "time" else float)
+        index[column] = (values, np.argsort(values, kind="stable"), kind)
+    with _time_indexes_lock:
+        _time_indexes[data_hash] = index
+        if len(_time_indexes) > TIME_INDEX_CACHE_SIZE:
+            _time_indexes.popitem(last=False)
+    return index
+
+
+def choose_frequency(timestamps, max_points=MAX_LINE_POINTS):
+    """
+    Picks the finest frequency that yields at most max_points periods.
+
+    Parameters:
+        timestamps: A sorted datetime64 Series without missing values.
+        max_points: The point budget per line.
+
+    Returns:
+        A (label, period code) tuple from FREQUENCIES. When several frequencies keep every
+        distinct period (e.g. yearly data), the coarsest of them is returned.
+    """
+    counts = [timestamps.dt.to_period(code).nunique() for _, code in FREQUENCIES]
+    for position, count in enumerate(counts):
+        if count <= max_points:
+            # Prefer a coarser frequency that loses nothing, so the label matches the data
+            while position + 1 < len(counts) and counts[position + 1] == count:
+                position += 1
+            return FREQUENCIES[position]
+    return FREQUENCIES[-1]
+
+
+def bin_sequence(steps, max_points=MAX_LINE_POINTS):
+    """
+    Bins step numbers into at most max_points equally wide bins.
+
+    Parameters:
+        steps: A float Series of integer step numbers without missing values.
+        max_points: The point budget per line.
+
+    Returns:
+        A (binned, label) tuple, where binned holds the first step of each value's bin.
+    """
+    first, last = steps.min(), steps.max()
+    width = max(1, math.ceil((last - first + 1) / max_points))
+    if width == 1:
+        return steps, "step"
+    return first + ((steps - first) // width) * width, f"{width} steps"
+
+
+def resample_line(data, data_hash, x_axis, y_axis, group=None, max_points=MAX_LINE_POINTS):
+    """
+    Aggregates a Line chart over a temporal x-axis.
+
+    Parameters:
+        data: The uploaded DataFrame.
+        data_hash: The dataset identifier used as cache key.
+        x_axis: The column plotted on the x-axis.
+        y_axis: The column plotted on the y-axis.
+        group: Optional column drawn as one line per value.
+        max_points: The point budget per line.
+
+    Returns:
+        A (frame, label) tuple, or None if x_axis is not temporal. The frame holds the x_axis,
+        y_axis and group columns sorted by x_axis, with numeric y values averaged and other
+        y values counted per period or bin; label describes this (e.g. 'mean per month').
+    """
+    index = index_time_columns(data, data_hash)
+    if x_axis not in index or y_axis not in data.columns or y_axis == x_axis:
+        return None
+    parsed, order, kind = index[x_axis]
+
+    x_values = pd.Series(parsed[order])
+    values = data[y_axis].iloc[order].reset_index(drop=True)
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.notna().any():
+        values, how = numeric, "mean"
+    else:
+        how = "count"
+    frame = pd.DataFrame({x_axis: x_values, y_axis: values})
+    if group is not None:
+        frame[group] = data[group].iloc[order].to_numpy()
+    frame = frame[frame[x_axis].notna()]
+
+    if kind == "sequence":
+        frame[x_axis], label = bin_sequence(frame[x_axis], max_points)
+    else:
+        label, code = choose_frequency(frame[x_axis], max_points)
+        frame[x_axis] = frame[x_axis].dt.to_period(code).dt.to_timestamp()
+    keys = [x_axis] if group is None else [x_axis, group]
+    # Rows are already in x order, so grouping can keep first-appearance order instead of sorting
+    resampled = frame.groupby(keys, sort=False, dropna=False)[y_axis].agg(how).reset_index()
+    return resampled, f"{how} per {label}"
+
+
+def prepare_line(data, data_hash, x_axis, y_axis, z_axis, title):
+    """
+    Prepares the frame and axes for a Line chart.
+
+    Parameters:
+        data: The uploaded DataFrame.
+        data_hash: The dataset identifier used as cache key.
+        x_axis, y_axis, z_axis: Columns chosen by generate_graph_spec.
+        title: The graph title.
+
+    Returns:
+        A (frame, x_axis, y_axis, z_axis, title) tuple. When x_axis is a date or sequence column
+        the frame is resampled and z_axis is kept as the line grouping if it has few distinct values;
+        otherwise the original data is returned with z_axis unset.
+    """
+    group = None
+    if z_axis in data.columns and z_axis not in (x_axis, y_axis) and data[z_axis].nunique() <= MAX_LINE_GROUPS:
+        group = z_axis
+    result = resample_line(data, data_hash, x_axis, y_axis, group)
+    if result is None:
+        return data, x_axis, y_axis, None, title
+    frame, label = result
+    return frame, x_axis, y_axis, group, f"{title} ({label})"
@@ -0,0 +1,336 @@
+import math
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+from flask import has_request_context, request
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+"""
+This module governs the token usage of every OpenAI call.
+Before a call it estimates the prompt size locally, trims the lowest-value prompt sections to
+fit the call site's budget, picks max_tokens from the output lengths observed at that site,
+and enforces a per-session token quota. Measurements are exposed through token_metrics.
+"""
+
+# Model used by every call site.
+MODEL = "gpt-4o"
+
+# Per call site: prompt token budget, and the floor and cap for max_tokens.
+# The caps are the values the call sites used before the governor existed.
+CALL_SITES = {
+    "details_table": {"prompt_budget": 4000, "min_tokens": 200, "max_tokens": 1000},
+    "upload_summary": {"prompt_budget": 6000, "min_tokens": 200, "max_tokens": 1000},
+    "ask": {"prompt_budget": 4000, "min_tokens": 60, "max_tokens": 300},
+    "ask_packed": {"prompt_budget": 5000, "min_tokens": 30, "max_tokens": 100},
+    "graph_recommendation": {"prompt_budget": 4000, "min_tokens": 10, "max_tokens": 150},
+    "graph_validation": {"prompt_budget": 4000, "min_tokens": 10, "max_tokens": 150},
+    "graph_columns": {"prompt_budget": 4000, "min_tokens": 30, "max_tokens": 150},
+    "graph_title": {"prompt_budget": 3000, "min_tokens": 30, "max_tokens": 150},
+}
+
+# Tokens a session may spend per quota window, and the window length in seconds.
+SESSION_TOKEN_QUOTA = int(os.getenv("SESSION_TOKEN_QUOTA", "200000"))
+SESSION_QUOTA_WINDOW = int(os.getenv("SESSION_QUOTA_WINDOW", "3600"))
+
+# Sessions with expired windows are forgotten once more than this many are tracked.
+MAX_TRACKED_SESSIONS = 1000
+
+# Number of output lengths remembered per call site, and how many are needed before they are trusted.
+OUTPUT_HISTORY_SIZE = 200
+MIN_OUTPUT_SAMPLES = 20
+
+# max_tokens is set to this percentile of observed output lengths, times the headroom factor.
+OUTPUT_PERCENTILE = 0.95
+OUTPUT_HEADROOM = 1.25
+
+# Characters per token assumed by the fallback estimator before calibration.
+CHARS_PER_TOKEN = 4.0
+
+# Tokens added by the chat format for each message and for the reply.
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+# Marker appended to sections that were shortened to fit the budget.
+TRUNCATION_MARKER = " ...[truncated]"
+
+# A prompt part that may be shortened. Lower priority parts are trimmed first; keep="head"
+# keeps the beginning of the text and keep="tail" keeps the end.
+Section = namedtuple("Section", ["text", "priority", "keep"], defaults=[0, "head"])
+
+
+class TokenQuotaExceeded(Exception):
+    """
+    Raised when a call would take a session over its token quota.
+    """
+
+
+_encoding = tiktoken.get_encoding("o200k_base") if tiktoken is not None else None
+_lock = threading.Lock()
+
+# Ratio of actual prompt tokens reported by the API to local estimates, updated after every call.
+_calibration = 1.0
+
+# Per call site: observed output tokens per unit, and running counters.
+_outputs = {site: deque(maxlen=OUTPUT_HISTORY_SIZE) for site in CALL_SITES}
+_stats = {
+    site: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_prompt_tokens": 0,
+           "trimmed_calls": 0, "truncated_outputs": 0}
+    for site in CALL_SITES
+}
+
+# Per session: [window start time, tokens used in the window].
+_sessions = {}
+
+
+def _raw_estimate(text):
+    """
+    Counts tokens with tiktoken when installed, otherwise approximates from the length.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens in a text, calibrated against API usage reports.
+    """
+    return math.ceil(_raw_estimate(text) * _calibration)
+
+
+def estimate_prompt_tokens(messages, calibrated=True):
+    """
+    Estimates the prompt tokens of a list of chat messages, including the chat format overhead.
+    """
+    estimate = estimate_tokens if calibrated else _raw_estimate
+    return sum(estimate(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages) \
+        + REPLY_OVERHEAD_TOKENS
+
+
+def _truncate(section, keep_chars):
+    """
+    Shortens a section to about keep_chars characters, keeping its head or tail.
+    """
+    if keep_chars <= 0:
+        return ""
+    if keep_chars >= len(section.text):
+        return section.text
+    if section.keep == "tail":
+        return TRUNCATION_MARKER.strip() + " " + section.text[-keep_chars:]
+    return section.text[:keep_chars] + TRUNCATION_MARKER
+
+
+def fit_prompt(parts, budget, fixed_tokens=0):
+    """
+    Joins prompt parts into one prompt of at most budget tokens.
+
+    Parameters:
+        parts: A list of plain strings, which are always kept, and Section values, which may be shortened.
+        budget: The token budget for the joined prompt.
+        fixed_tokens: Tokens already used by other messages (e.g. the system message).
+
+    Returns:
+        A (prompt, trimmed) tuple, where trimmed tells whether any section was shortened.
+        Sections are shortened in order of increasing priority; if the plain strings alone
+        exceed the budget, every section is emptied and the prompt is returned as is.
+    """
+    texts = [part.text if isinstance(part, Section) else part for part in parts]
+    excess = fixed_tokens + estimate_tokens("".join(texts)) - budget
+    if excess <= 0:
+        return "".join(texts), False
+
+    sections = sorted(
+        (position for position, part in enumerate(parts) if isinstance(part, Section)),
+        key=lambda position: parts[position].priority,
+    )
+    for position in sections:
+        section = parts[position]
+        section_tokens = estimate_tokens(section.text)
+        if section_tokens == 0:
+            continue
+        # Keep the share of the section that fits, with a small margin for the estimate's error
+        keep_share = max(0.0, 1 - (excess / section_tokens) * 1.05)
+        texts[position] = _truncate(section, int(len(section.text) * keep_share))
+        excess = fixed_tokens + estimate_tokens("".join(texts)) - budget
+        if excess <= 0:
+            break
+    return "".join(texts), True
+
+
+def choose_max_tokens(site, units=1):
+    """
+    Picks max_tokens for a call from the output lengths observed at its call site.
+
+    Parameters:
+        site: The call site name from CALL_SITES.
+        units: Number of answers requested in one call (e.g. packed questions); the
+            site's floor, cap and observations are per unit.
+
+    Returns:
+        The configured cap until enough outputs were observed, then a high percentile of the
+        observed lengths with some headroom, clamped between the site's floor and cap.
+    """
+    config = CALL_SITES[site]
+    with _lock:
+        observed = sorted(_outputs[site])
+    if len(observed) < MIN_OUTPUT_SAMPLES:
+        return config["max_tokens"] * units
+    percentile = observed[min(len(observed) - 1, int(len(observed) * OUTPUT_PERCENTILE))]
+    per_unit = min(max(math.ceil(percentile * OUTPUT_HEADROOM), config["min_tokens"]), config["max_tokens"])
+    return per_unit * units
+
+
+def current_session():
+    """
+    Identifies the session a call is made for.
+
+    Returns:
+        The client address, or 'background' outside of a request. Client-supplied identifiers
+        (headers or cookies) are not used, since a client could rotate them to reset its quota.
+    """
+    if not has_request_context():
+        return "background"
+    return request.remote_addr or "anonymous"
+
+
+def _reserve(session, tokens):
+    """
+    Reserves tokens in a session's current quota window, so that concurrent calls of one session
+    (e.g. a batch of questions) cannot together exceed the quota.
+
+    Returns:
+        The start time of the window holding the reservation, to be passed to _settle.
+
+    Raises:
+        TokenQuotaExceeded: If the call would exceed the session's quota.
+    """
+    now = time.monotonic()
+    with _lock:
+        if len(_sessions) > MAX_TRACKED_SESSIONS:
+            for expired in [key for key, (start, _) in _sessions.items() if now - start >= SESSION_QUOTA_WINDOW]:
+                del _sessions[expired]
+        window = _sessions.setdefault(session, [now, 0])
+        if now - window[0] >= SESSION_QUOTA_WINDOW:
+            window[0], window[1] = now, 0
+        if window[1] + tokens > SESSION_TOKEN_QUOTA:
+            raise TokenQuotaExceeded(
+                f"Session token quota of {SESSION_TOKEN_QUOTA} tokens per {SESSION_QUOTA_WINDOW}s exceeded"
+            )
+        window[1] += tokens
+        return window[0]
+
+
+def _settle(session, window_start, reserved, used):
+    """
+    Replaces a reservation made by _reserve with the tokens actually used. Must hold _lock.
+    """
+    window = _sessions.get(session)
+    if window is not None and window[0] == window_start:
+        window[1] = max(window[1] - reserved, 0) + used
+    elif used:
+        # The window the reservation was made in has expired, so only the usage counts
+        window = _sessions.setdefault(session, [time.monotonic(), 0])
+        window[1] += used
+
+
+def _record(site, session, window_start, reserved, estimated, raw_estimated, prompt_tokens, completion_tokens,
+            units, truncated, trimmed):
+    """
+    Updates the calibration, observed output lengths, counters and session usage after a call.
+    """
+    global _calibration
+    with _lock:
+        if raw_estimated:
+            _calibration = min(max(0.9 * _calibration + 0.1 * prompt_tokens / raw_estimated, 0.5), 2.0)
+        # A cut-off output says nothing about the length it needed, so count it at the cap
+        # to let max_tokens grow back after being lowered too far
+        _outputs[site].append(CALL_SITES[site]["max_tokens"] if truncated else completion_tokens / units)
+        stats = _stats[site]
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        stats["estimated_prompt_tokens"] += estimated
+        stats["trimmed_calls"] += int(trimmed)
+        stats["truncated_outputs"] += int(truncated)
+        _settle(session, window_start, reserved, prompt_tokens + completion_tokens)
+
+
+def complete(client, site, parts, system=None, session=None, units=1):
+    """
+    Makes a chat completion within the call site's token budget.
+
+    Parameters:
+        client: The OpenAI client.
+        site: The call site name from CALL_SITES.
+        parts: The user prompt as a list of plain strings and Section values (see fit_prompt).
+        system: Optional system message.
+        session: The session to charge; defaults to current_session().
+        units: Number of answers requested in one call (see choose_max_tokens).
+
+    Returns:
+        The OpenAI chat completion response.
+
+    Raises:
+        TokenQuotaExceeded: If the call would exceed the session's token quota.
+    """
+    session = session or current_session()
+    messages = [{"role": "system", "content": system}] if system else []
+    fixed_tokens = estimate_prompt_tokens(messages) + MESSAGE_OVERHEAD_TOKENS
+    prompt, trimmed = fit_prompt(parts, CALL_SITES[site]["prompt_budget"], fixed_tokens)
+    messages.append({"role": "user", "content": prompt})
+    estimated = estimate_prompt_tokens(messages)
+    max_tokens = choose_max_tokens(site, units)
+    reserved = estimated + max_tokens
+    window_start = _reserve(session, reserved)
+
+    try:
+        response = client.chat.completions.create(model=MODEL, messages=messages, max_tokens=max_tokens)
+    except Exception:
+        with _lock:
+            _settle(session, window_start, reserved, 0)
+        raise
+
+    usage = getattr(response, "usage", None)
+    prompt_tokens = usage.prompt_tokens if usage else estimated
+    completion_tokens = usage.completion_tokens if usage else estimate_tokens(response.choices[0].message.content or "")
+    truncated = response.choices[0].finish_reason == "length"
+    _record(site, session, window_start, reserved, estimated, estimate_prompt_tokens(messages, calibrated=False),
+            prompt_tokens, completion_tokens, units, truncated, trimmed)
+    return response
+
+
+def token_metrics(session=None):
+    """
+    Summarizes the token measurements collected so far.
+
+    Parameters:
+        session: The session asking; only its own usage is reported individually.
+
+    Returns:
+        A dict with the estimator in use, the calibration factor, per call site counters and
+        current max_tokens, the number of tracked sessions and their total usage, and the
+        given session's usage in its current quota window.
+    """
+    sites = {}
+    for site, config in CALL_SITES.items():
+        with _lock:
+            stats = dict(_stats[site])
+        sites[site] = {**stats, "prompt_budget": config["prompt_budget"], "max_tokens": choose_max_tokens(site)}
+    with _lock:
+        sessions = {"tracked": len(_sessions), "tokens_used": sum(used for _, used in _sessions.values())}
+        window = _sessions.get(session)
+        own = {"tokens_used": window[1] if window else 0, "quota": SESSION_TOKEN_QUOTA}
+        calibration = _calibration
+    return {
+        "estimator": "tiktoken" if _encoding is not None else "characters",
+        "calibration": round(calibration, 3),
+        "sites": sites,
+        "sessions": sessions,
+        "session": own,
+    }